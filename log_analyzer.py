@@ -20,6 +20,12 @@ from string import Template
 import pprint
 import time
 import argparse
+import operator
+import functools
+import itertools
+import tempfile
+import random
+import math
 
 config = {
     "REPORT_SIZE": 10,
@@ -28,11 +34,43 @@ config = {
     "TEMPLATE": "report.html",
     "ERRORS_THRESHOLD": 25,
     "LOG_FILE": "log_analyzer.log",
-    "TIME_STAMPDIR": ""
+    "TIME_STAMPDIR": "",
+    "FLUSH_INTERVAL": 0,
+    "LOG_FORMAT": "",
+    "MEMORY_LIMIT": 0,
+    "SAMPLE_MAX_LINES": 100000
 }
 
 CONFIG_NAME = 'log_analyzer.cfg'
 
+STREAM_BUFFER_SIZE = 1024 * 1024
+INTERIM_SUFFIX = '-interim'
+
+LOG_FORMAT_VARIABLE = re.compile(r'\$\{?(\w+)\}?')
+LOG_FORMAT_FIELDS = {
+    'request': r'(?:GET|POST|HEAD|PUT) (?P<url>[^"]+)HTTP/1\..',
+    'request_time': r'(?P<request_time>\d+\.\d+)'
+}
+LOG_FORMAT_WORDS = {
+    'remote_addr', 'remote_port', 'server_addr', 'server_port',
+    'server_protocol', 'request_method', 'scheme', 'status',
+    'body_bytes_sent', 'bytes_sent', 'request_length', 'request_time',
+    'msec', 'pipe', 'connection', 'connection_requests', 'time_iso8601',
+    'request_id'
+}
+LOG_FORMAT_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
+REQUEST_TIME = re.compile(r'\d+\.\d+')
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SPILL_AGGREGATE_SIZE = 1000
+SPILL_URL_SIZE = sys.getsizeof([0]) + 100
+SPILL_TIME_SIZE = 8
+SPILL_MAX_RUNS = 32
+
+SAMPLE_READ_SIZE = 512
+SAMPLE_HEAD_SIZE = 1024 * 1024
+SAMPLE_Z = 1.96
+
 
 def exception_handler(exc_type, value, tb):
     """
@@ -130,28 +168,207 @@ def open_log_file(log_name):
     return log_file
 
 
-def process_log_file(log_name):
+def process_log_line(line):
+    """
+    Function parses one line of log file and returns url and request time or
+    None,None in case of parsing error.
+    """
+    regex = r'(?P<ipaddress>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) (?P<ruser>.+) (?P<xrip>.+) \[(?P<dateandtime>\d{2}\/[a-z]{3}\/\d{4}:\d{2}:\d{2}:\d{2} (\+|\-)\d{4})\] ((\"(GET|POST|HEAD|PUT) )(?P<url>.+)(http\/1\..\")) (?P<statuscode>\d{3}) (?P<bytessent>\d+) ([\"](?P<referer>(\-)|(.+))[\"]) ([\"](?P<useragent>.+)[\"]) ([\"](?P<f1>.+)[\"]) ([\"](?P<f2>.+)[\"]) ([\"](?P<f3>.+)[\"]) (?P<requesttime>\d+.\d+)'
+    line_parsed = re.match(regex, line, re.I)
+    if line_parsed:
+        return line_parsed.group('url', 'requesttime')
+    else:
+        return None, None
+
+
+def split_log_format(log_format):
+    """
+    Function splits nginx log_format definition log_format into tokens like
+    nginx configuration parser does and returns list of (token, quoted)
+    pairs. Backslash escapes in quoted tokens are unescaped.
+    """
+    tokens = []
+    pos = 0
+    while pos < len(log_format):
+        char = log_format[pos]
+        if char.isspace():
+            pos = pos + 1
+        elif char in ('"', "'"):
+            token = []
+            pos = pos + 1
+            while pos < len(log_format) and log_format[pos] != char:
+                if log_format[pos] == '\\' and pos + 1 < len(log_format):
+                    pos = pos + 1
+                    token.append(LOG_FORMAT_ESCAPES.get(log_format[pos],
+                                                        log_format[pos]))
+                else:
+                    token.append(log_format[pos])
+                pos = pos + 1
+            tokens.append((''.join(token), True))
+            pos = pos + 1
+        else:
+            end = pos
+            while end < len(log_format) and not log_format[end].isspace():
+                end = end + 1
+            tokens.append((log_format[pos:end], False))
+            pos = end
+    return tokens
+
+
+def normalize_log_format(log_format):
+    """
+    Function extracts format string from nginx log_format definition
+    log_format skipping format name and escape parameter, joining format
+    strings and collapsing whitespaces. If log_format isn't a log_format
+    directive it is considered to be a format string.
+    """
+    log_format = log_format.strip().rstrip(';')
+    if log_format.split(None, 1)[:1] == ['log_format']:
+        tokens = split_log_format(log_format)[2:]
+        if tokens and not tokens[0][1] and tokens[0][0].startswith('escape='):
+            tokens = tokens[1:]
+        log_format = ''.join(token for token, _ in tokens)
+    return ' '.join(log_format.split())
+
+
+def literal_regex(literal):
+    """
+    Function returns regex for log_format literal matching any number of
+    spaces in place of whitespaces.
+    """
+    return ' +'.join(re.escape(part) for part in literal.split(' '))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_log_format(log_format):
+    """
+    Function compiles nginx log_format definition log_format into parser
+    function which extracts url and request time from log line or returns
+    None,None in case of parsing error. Only fields needed for aggregation
+    are captured, request time at the end of line is taken without regex
+    matching. Fields followed by whitespace are matched non-greedy since
+    they may contain spaces, unless they are known to be single words.
+    Adjacent non-greedy fields are merged into one to avoid excessive
+    backtracking on lines which don't match. $request is matched by the same rules as in process_log_line:
+    GET, POST, HEAD or PUT method and HTTP/1.x protocol in any letter case.
+    Returns None if log_format lacks needed fields.
+    """
+    tokens = LOG_FORMAT_VARIABLE.split(normalize_log_format(log_format))
+    literals, variables = tokens[0::2], tokens[1::2]
+    for field in LOG_FORMAT_FIELDS:
+        if variables.count(field) != 1:
+            logging.error('Log format must contain $' + field +
+                          ' exactly once: ' + log_format)
+            return None
+
+    tail_time = variables[-1] == 'request_time' and not literals[-1].strip()
+    if tail_time:
+        variables = variables[:-1]
+        literals = literals[:-1]
+
+    regex = literal_regex(literals[0])
+    merged = False
+    for index, (variable, literal) in enumerate(zip(variables, literals[1:])):
+        if variable in LOG_FORMAT_FIELDS:
+            regex += LOG_FORMAT_FIELDS[variable]
+        else:
+            if merged or not literal or literal[0].isspace() and \
+                    variable not in LOG_FORMAT_WORDS:
+                pattern = '.*?'
+            elif literal[0].isspace():
+                pattern = r'\S*'
+            else:
+                pattern = '[^' + re.escape(literal[0]) + ']*'
+            next_variable = variables[index + 1] if index + 1 < len(variables) else None
+            merged = pattern == '.*?' and not literal.strip() and \
+                next_variable is not None and next_variable not in LOG_FORMAT_FIELDS
+            if merged:
+                continue
+            regex += pattern
+        regex += literal_regex(literal)
+    match = re.compile(regex, re.I).match
+
+    if tail_time:
+        def parse_line(line):
+            line_parsed = match(line)
+            if line_parsed:
+                requesttime = line[line_parsed.end():].strip()
+                if REQUEST_TIME.fullmatch(requesttime):
+                    return line_parsed.group('url'), requesttime
+            return None, None
+    else:
+        def parse_line(line):
+            line_parsed = match(line)
+            if line_parsed:
+                return line_parsed.group('url', 'request_time')
+            return None, None
+    return parse_line
+
+
+def get_log_parser(config):
+    """
+    Function returns log line parser for LOG_FORMAT or default parser
+    process_log_line if LOG_FORMAT isn't set.
+    """
+    log_format = config.get('LOG_FORMAT')
+    if not log_format:
+        return process_log_line
+    logging.info('Using log format ' + normalize_log_format(log_format))
+    return compile_log_format(log_format)
+
+
+def new_stat_data():
+    """
+    Function returns empty statistic information dictionary.
+    """
+    return {'sum_requests_number': 0,
+            'sum_requests_time': Decimal(0),
+            'parsing_errors': 0,
+            'total_requests': 0}
+
+
+def process_log_lines(lines, report_data, stat_data,
+                      parse_line=process_log_line, spill_data=None):
+    """
+    Function processes log lines with parse_line updating report_data in
+    place and returns updated statistic information dictionary stat_data.
+    If spill_data is given, parsed lines are collected there instead of
+    report_data.
+    """
+    if spill_data is not None:
+        for line in lines:
+            url, requesttime = parse_line(line)
+            stat_data = update_stat_data(stat_data, url, requesttime)
+            if url is not None:
+                spill_line(spill_data, url, requesttime)
+        return stat_data
+    for line in lines:
+        url, requesttime = parse_line(line)
+        url_data, stat_data = process_line_data(stat_data, url,
+                                                report_data,
+                                                requesttime)
+        if url_data is not None:
+            report_data[url] = url_data
+    return stat_data
+
+
+def process_log_file(log_name, parse_line=process_log_line, spill_data=None):
     """
     Function processes log file log_name and returns raw report data dictonary
     report_data and statistic information dictionary stat_data.
     """
     report_data = {}
-    stat_data = {'sum_requests_number': 0,
-                 'sum_requests_time': Decimal(0),
-                 'parsing_errors': 0,
-                 'total_requests': 0}
+    stat_data = new_stat_data()
     log_file = open_log_file(log_name)
     if log_file is None:
         return None, None
     logging.info('Processing log file: ' + log_name)
     try:
-        for line in log_file:
-            url, requesttime = process_log_line(line)
-            url_data, stat_data = process_line_data(stat_data, url,
-                                                    report_data,
-                                                    requesttime)
-            if url_data is not None:
-                report_data[url] = url_data
+        stat_data = process_log_lines(log_file, report_data, stat_data,
+                                      parse_line, spill_data)
+    except SpillError:
+        logging.exception('Error spilling aggregation data to disk!')
+        return None, None
     except OSError:
         logging.exception('Error reading file ' + log_name + '!')
         return None, None
@@ -160,35 +377,433 @@ def process_log_file(log_name):
     return report_data, stat_data
 
 
+def read_stream_chunks(stream, buffer_size=STREAM_BUFFER_SIZE):
+    """
+    Generator reads binary stream by chunks of up to buffer_size bytes and
+    yields lists of decoded complete lines. Incomplete last line of a chunk
+    is carried over to the next one.
+    """
+    read = getattr(stream, 'read1', stream.read)
+    tail = b''
+    while True:
+        chunk = read(buffer_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        yield [line.decode('utf-8', errors='replace') for line in lines]
+    if tail:
+        yield [tail.decode('utf-8', errors='replace')]
+
+
+def process_log_stream(stream, log_date, config,
+                       parse_line=process_log_line, spill_data=None):
+    """
+    Function processes binary stream of log lines and returns raw report data
+    dictonary report_data and statistic information dictionary stat_data.
+    Every FLUSH_INTERVAL seconds an interim report for log_date is generated
+    unless parsing errors exceed ERRORS_THRESHOLD.
+    """
+    report_data = {}
+    stat_data = new_stat_data()
+    flush_interval = float(config.get('FLUSH_INTERVAL', 0))
+    last_flush = time.monotonic()
+    logging.info('Processing log stream')
+    try:
+        for lines in read_stream_chunks(stream):
+            stat_data = process_log_lines(lines, report_data, stat_data,
+                                          parse_line, spill_data)
+            if flush_interval and time.monotonic() - last_flush >= flush_interval:
+                logging.info('Flushing interim report, ' +
+                             str(stat_data['total_requests']) +
+                             ' lines processed')
+                if errors_exceeded(stat_data, config):
+                    logging.error('Interim report is skipped.')
+                else:
+                    make_report(report_data, stat_data, log_date, config,
+                                spill_data, INTERIM_SUFFIX)
+                last_flush = time.monotonic()
+    except SpillError:
+        logging.exception('Error spilling aggregation data to disk!')
+        return None, None
+    except OSError:
+        logging.exception('Error reading log stream!')
+        return None, None
+    return report_data, stat_data
+
+
+def read_sampled_line(log_file, offset, size):
+    """
+    Function resynchronizes binary log_file of size bytes on the next newline
+    after offset and returns length of the skipped line containing offset and
+    the next line or None,None if there is no next line.
+    """
+    window = SAMPLE_READ_SIZE
+    while True:
+        start = max(0, offset - window)
+        log_file.seek(start)
+        read_size = offset - start + window
+        block = log_file.read(read_size)
+        at_eof = len(block) < read_size or start + len(block) >= size
+        pos = offset - start
+        line_start = block.rfind(b'\n', 0, pos) + 1
+        line_end = block.find(b'\n', pos)
+        next_end = block.find(b'\n', line_end + 1) if line_end != -1 else -1
+        if line_start == 0 and start > 0 or line_end == -1 and not at_eof or \
+                next_end == -1 and not at_eof:
+            window = window * 2
+            continue
+        if line_end == -1 or line_end + 1 == len(block):
+            return None, None
+        if next_end == -1:
+            next_end = len(block)
+        return (line_end + 1 - line_start,
+                block[line_end + 1:next_end].decode('utf-8', errors='replace'))
+
+
+def estimate_lines_number(log_file, size):
+    """
+    Function estimates number of lines in binary log_file of size bytes by
+    average length of lines at the beginning of file.
+    """
+    head = log_file.read(SAMPLE_HEAD_SIZE)
+    return size * max(head.count(b'\n'), 1) / max(len(head), 1)
+
+
+def process_log_sample(log_name, fraction, max_draws,
+                       parse_line=process_log_line, generator=None):
+    """
+    Function processes approximately fraction of lines, but no more than
+    max_draws lines, of uncompressed log file log_name read at random byte
+    offsets and returns scaled report data dictonary report_data and
+    estimated statistic information dictionary stat_data. Line following a
+    random offset is picked with probability proportional to length of the
+    line containing offset, so every sampled line is weighted by inverse of
+    this probability. If sampling would read about as much as the whole file,
+    the file is processed completely. Offsets are drawn from random.Random
+    generator or from module level generator if it isn't given.
+    """
+    if generator is None:
+        generator = random
+    if log_name.lower().endswith('.gz'):
+        logging.error('Sampling of compressed log file ' + log_name +
+                      ' is not supported!')
+        return None, None
+    try:
+        size = os.path.getsize(log_name)
+        with open(log_name, 'rb', buffering=0) as log_file:
+            draws = max(1, min(int(fraction * estimate_lines_number(log_file,
+                                                                    size)),
+                               int(max_draws)))
+            if draws * 2 * SAMPLE_READ_SIZE >= size:
+                logging.info('Sample covers whole log file')
+                return process_log_file(log_name, parse_line)
+            logging.info('Sampling log file: ' + log_name)
+            offsets = sorted(generator.randrange(size) for _ in range(draws)) \
+                if size else []
+            report_data = {}
+            sample_data = {}
+            weights = {'total_requests': [0.0, 0.0],
+                       'parsing_errors': [0.0, 0.0]}
+            for offset in offsets:
+                line_size, line = read_sampled_line(log_file, offset, size)
+                if line is None:
+                    continue
+                weight = size / line_size
+                add_weight(weights['total_requests'], weight)
+                url, requesttime = parse_line(line)
+                if url is None:
+                    add_weight(weights['parsing_errors'], weight)
+                    continue
+                report_data[url] = analyze_log_line(report_data, url,
+                                                    requesttime)
+                sample_data.setdefault(url, [0.0, 0.0, 0.0, 0.0])
+                add_sample(sample_data[url], weight, float(requesttime))
+    except OSError:
+        logging.exception('Error reading file ' + log_name + '!')
+        return None, None
+    logging.info('Sampled ' + str(len(offsets)) + ' offsets')
+    return scale_sample_data(report_data, sample_data, weights, len(offsets))
+
+
+def add_weight(weight_sums, weight):
+    """
+    Function adds weight of one sampled line to sums of weights and their
+    squares weight_sums.
+    """
+    weight_sums[0] = weight_sums[0] + weight
+    weight_sums[1] = weight_sums[1] + weight * weight
+
+
+def add_sample(url_sample, weight, requesttime):
+    """
+    Function adds weighted count and request time of one sampled line to sums
+    of values and their squares url_sample.
+    """
+    url_sample[0] = url_sample[0] + weight
+    url_sample[1] = url_sample[1] + weight * weight
+    url_sample[2] = url_sample[2] + weight * requesttime
+    url_sample[3] = url_sample[3] + (weight * requesttime) ** 2
+
+
+def estimate_interval(value_sum, square_sum, draws):
+    """
+    Function returns estimate of total and its confidence interval by sums of
+    per draw values value_sum and their squares square_sum.
+    """
+    mean = value_sum / draws
+    if draws < 2:
+        return mean, mean, mean
+    variance = max(square_sum / draws - mean * mean, 0.0) * draws / (draws - 1)
+    delta = SAMPLE_Z * math.sqrt(variance / draws)
+    return mean, max(mean - delta, 0.0), mean + delta
+
+
+def scale_sample_data(report_data, sample_data, weights, draws):
+    """
+    Function replaces sampled 'count' and 'time_sum' in report_data with
+    estimated totals, adds their confidence intervals 'count_ci' and
+    'time_sum_ci' and returns it with estimated statistic information
+    dictionary stat_data with confidence intervals 'total_requests_ci' and
+    'parsing_errors_ci'.
+    """
+    stat_data = new_stat_data()
+    if not draws:
+        return report_data, stat_data
+    for url, url_data in report_data.items():
+        count, count_low, count_high = estimate_interval(
+            sample_data[url][0], sample_data[url][1], draws)
+        time_sum, time_low, time_high = estimate_interval(
+            sample_data[url][2], sample_data[url][3], draws)
+        url_data['count'] = max(int(round(count)), 1)
+        url_data['time_sum'] = Decimal(time_sum)
+        url_data['count_ci'] = (int(round(count_low)), int(round(count_high)))
+        url_data['time_sum_ci'] = (Decimal(time_low), Decimal(time_high))
+        stat_data['sum_requests_number'] = stat_data['sum_requests_number'] + url_data['count']
+        stat_data['sum_requests_time'] = stat_data['sum_requests_time'] + url_data['time_sum']
+    for key, weight_sums in weights.items():
+        estimate, low, high = estimate_interval(weight_sums[0],
+                                                weight_sums[1], draws)
+        stat_data[key] = int(round(estimate))
+        stat_data[key + '_ci'] = (int(round(low)), int(round(high)))
+    return report_data, stat_data
+
+
 def process_line_data(stat_data, url, report_data, requesttime):
     """
     Function processes data from one log line and returns updated dictionaries
     updated_data and local_stat_data.
     """
+    local_stat_data = update_stat_data(stat_data, url, requesttime)
+    if url is not None:
+        updated_data = analyze_log_line(report_data, url, requesttime)
+    else:
+        updated_data = None
+    return updated_data, local_stat_data
+
+
+def update_stat_data(stat_data, url, requesttime):
+    """
+    Function updates statistic information with one log line data and returns
+    new dictionary local_stat_data.
+    """
     local_stat_data = stat_data.copy()
     local_stat_data['total_requests'] = local_stat_data['total_requests'] + 1
     if url is not None:
-        updated_data = analyze_log_line(report_data, url, requesttime)
-        # local_report_data[url] = updated_data
         local_stat_data['sum_requests_number'] = local_stat_data['sum_requests_number'] + 1
         local_stat_data['sum_requests_time'] = local_stat_data['sum_requests_time'] + Decimal(requesttime)
     else:
         local_stat_data['parsing_errors'] = local_stat_data['parsing_errors'] + 1
-        updated_data = None
-    return updated_data, local_stat_data
+    return local_stat_data
 
 
-def process_log_line(line):
+def parse_size(value):
     """
-    Function parses one line of log file and returns url and request time or
-    None,None in case of parsing error.
+    Function converts size value with optional K, M or G suffix to number of
+    bytes. Returns None if value has wrong format.
     """
-    regex = r'(?P<ipaddress>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) (?P<ruser>.+) (?P<xrip>.+) \[(?P<dateandtime>\d{2}\/[a-z]{3}\/\d{4}:\d{2}:\d{2}:\d{2} (\+|\-)\d{4})\] ((\"(GET|POST|HEAD|PUT) )(?P<url>.+)(http\/1\..\")) (?P<statuscode>\d{3}) (?P<bytessent>\d+) ([\"](?P<referer>(\-)|(.+))[\"]) ([\"](?P<useragent>.+)[\"]) ([\"](?P<f1>.+)[\"]) ([\"](?P<f2>.+)[\"]) ([\"](?P<f3>.+)[\"]) (?P<requesttime>\d+.\d+)'
-    line_parsed = re.match(regex, line, re.I)
-    if line_parsed:
-        return line_parsed.group('url', 'requesttime')
+    size = re.fullmatch(r'\s*(\d+)\s*([KMG]?)B?\s*', str(value), re.I)
+    if size is None:
+        logging.error('Wrong size value ' + str(value))
+        return None
+    return int(size.group(1)) * SIZE_UNITS[size.group(2).upper()]
+
+
+class SpillError(Exception):
+    """
+    Error of writing or reading aggregation data spilled to disk.
+    """
+
+
+def new_spill_data(memory_limit, max_runs=SPILL_MAX_RUNS):
+    """
+    Function returns empty spill store for aggregation under memory_limit
+    bytes. Until the first spill urls are aggregated in memory as usual and
+    then written to disk as sorted prefix of aggregates. Since median
+    depends on order of request times, after that request times of urls are
+    kept in memory in order of appearance and spilled to sorted runs, which
+    are merged into prefix when there are max_runs of them. Every url keeps
+    index of its first appearance, so merged results are identical to
+    in-memory aggregation.
+    """
+    return {'urls': {},
+            'prefix': None,
+            'runs': [],
+            'size': 0,
+            'index': 0,
+            'memory_limit': memory_limit,
+            'max_runs': max_runs}
+
+
+def spill_line(spill_data, url, requesttime):
+    """
+    Function adds one log line data to spill store spill_data and spills
+    store to disk if it exceeds memory limit.
+    """
+    urls = spill_data['urls']
+    if spill_data['prefix'] is None:
+        if url not in urls:
+            spill_data['size'] = spill_data['size'] + sys.getsizeof(url) + SPILL_AGGREGATE_SIZE
+        urls[url] = analyze_log_line(urls, url, requesttime)
     else:
-        return None, None
+        times = urls.get(url)
+        if times is None:
+            times = urls[url] = [spill_data['index']]
+            spill_data['size'] = spill_data['size'] + sys.getsizeof(url) + SPILL_URL_SIZE
+        times.append(requesttime)
+        spill_data['size'] = spill_data['size'] + sys.getsizeof(requesttime) + SPILL_TIME_SIZE
+    spill_data['index'] = spill_data['index'] + 1
+    if spill_data['size'] > spill_data['memory_limit']:
+        spill_run(spill_data)
+
+
+def spill_run(spill_data):
+    """
+    Function writes urls of spill store spill_data sorted by url to disk and
+    clears store. Aggregates become prefix file, request times become run
+    file with one line per request.
+    """
+    try:
+        run = tempfile.TemporaryFile('w+t', encoding='utf-8', newline='\n')
+        if spill_data['prefix'] is None:
+            aggregates = sorted((url, index, url_data) for index, (url, url_data)
+                                in enumerate(spill_data['urls'].items()))
+            write_spill_aggregates(run, aggregates)
+            spill_data['prefix'] = run
+        else:
+            for url, times in sorted(spill_data['urls'].items()):
+                for requesttime in times[1:]:
+                    run.write(url + '\t' + str(times[0]) + '\t' + requesttime + '\n')
+            spill_data['runs'].append(run)
+    except OSError as e:
+        raise SpillError('Error writing spill file') from e
+    spill_data['urls'] = {}
+    spill_data['size'] = 0
+    logging.info('Spilled aggregation data to disk, ' +
+                 str(len(spill_data['runs'])) + ' runs')
+    if len(spill_data['runs']) >= spill_data['max_runs']:
+        compact_spill_data(spill_data)
+
+
+def write_spill_aggregates(spill_file, aggregates):
+    """
+    Function writes url, first appearance index and url data from aggregates
+    to spill_file.
+    """
+    for url, index, url_data in aggregates:
+        spill_file.write('\t'.join([url, str(index), str(url_data['count']),
+                                    str(url_data['time_sum']),
+                                    str(url_data['time_max']),
+                                    str(url_data['time_med'])]) + '\n')
+
+
+def compact_spill_data(spill_data):
+    """
+    Function merges prefix and runs of spill store spill_data into new prefix
+    and closes merged files.
+    """
+    try:
+        prefix = tempfile.TemporaryFile('w+t', encoding='utf-8', newline='\n')
+        write_spill_aggregates(prefix, merge_spill_data(spill_data))
+    except OSError as e:
+        raise SpillError('Error writing spill file') from e
+    close_spill_data(spill_data)
+    spill_data['prefix'] = prefix
+    logging.info('Merged spilled runs into aggregates')
+
+
+def read_spill_aggregates(spill_file):
+    """
+    Generator yields url, first appearance index and url data from aggregates
+    spill_file.
+    """
+    spill_file.seek(0)
+    for line in spill_file:
+        url, index, count, time_sum, time_max, time_med = line.rstrip('\n').split('\t')
+        yield url, int(index), {'count': int(count),
+                                'time_sum': Decimal(time_sum),
+                                'time_max': Decimal(time_max),
+                                'count_perc': 0,
+                                'time_perc': Decimal(0),
+                                'time_avg': Decimal(0),
+                                'time_med': Decimal(time_med)}
+
+
+def read_spill_run(run):
+    """
+    Generator yields url, first appearance index and request time from run
+    file.
+    """
+    run.seek(0)
+    for line in run:
+        url, index, requesttime = line.rstrip('\n').split('\t')
+        yield url, int(index), requesttime
+
+
+def merge_spill_data(spill_data):
+    """
+    Generator k-way merges prefix, sorted runs and in-memory part of spill
+    store spill_data and yields url, first appearance index and url data for
+    every url. Request times of url are replayed in order of appearance one by
+    one, so only one record of every run is kept in memory.
+    """
+    if spill_data['prefix'] is None:
+        for index, (url, url_data) in enumerate(spill_data['urls'].items()):
+            yield url, index, url_data
+        return
+    sources = [read_spill_aggregates(spill_data['prefix'])]
+    sources.extend(read_spill_run(run) for run in spill_data['runs'])
+    sources.append((url, times[0], requesttime) for url, times
+                   in sorted(spill_data['urls'].items())
+                   for requesttime in times[1:])
+    try:
+        merged = heapq.merge(*sources, key=operator.itemgetter(0))
+        for url, records in itertools.groupby(merged, key=operator.itemgetter(0)):
+            url_store = {}
+            first_index = None
+            for _, index, value in records:
+                if first_index is None:
+                    first_index = index
+                if isinstance(value, dict):
+                    url_store[url] = value
+                else:
+                    url_store[url] = analyze_log_line(url_store, url, value)
+            yield url, first_index, url_store[url]
+    except OSError as e:
+        raise SpillError('Error reading spill file') from e
+
+
+def close_spill_data(spill_data):
+    """
+    Function closes and removes prefix and run files of spill store
+    spill_data.
+    """
+    if spill_data['prefix'] is not None:
+        spill_data['prefix'].close()
+    for run in spill_data['runs']:
+        run.close()
+    spill_data['prefix'] = None
+    spill_data['runs'] = []
 
 
 def analyze_log_line(report_data, url, requesttime):
@@ -257,6 +872,10 @@ def construct_list(url, data):
     temp_dict['time_med'] = float(data['time_med'].quantize(Decimal('0.001')))
     temp_dict['time_perc'] = float(data['time_perc'].quantize(Decimal('0.001')))
     temp_dict['time_sum'] = float(data['time_sum'].quantize(Decimal('0.001')))
+    if 'count_ci' in data:
+        temp_dict['count_ci'] = list(data['count_ci'])
+        temp_dict['time_sum_ci'] = [float(value.quantize(Decimal('0.001')))
+                                    for value in data['time_sum_ci']]
     return temp_dict
 
 
@@ -268,9 +887,43 @@ def get_top_n_urls(sum_data, n):
     return [construct_list(url, sum_data[url]) for url in top_n_urls]
 
 
-def generate_report(data, log_date, config):
+def get_top_n_spilled_urls(spill_data, stat_data, n):
+    """
+    Fuction returns top n url data based on 'time_sum' field from spill store
+    spill_data. Urls with equal 'time_sum' are ordered by first appearance
+    like in get_top_n_urls.
+    """
+    sum_data = ((url, index, summarize_url(url_data, stat_data))
+                for url, index, url_data in merge_spill_data(spill_data))
+    top_n_urls = heapq.nlargest(int(n), sum_data,
+                                key=lambda item: (item[2]['time_sum'], -item[1]))
+    return [construct_list(url, data) for url, _, data in top_n_urls]
+
+
+def make_report(report_data, stat_data, log_date, config, spill_data=None,
+                suffix=''):
+    """
+    Function summarizes report_data or spill store spill_data, generates
+    report file with top REPORT_SIZE urls and report name suffix and returns
+    True if report is generated.
+    """
+    if spill_data is not None:
+        try:
+            top_n_urls = get_top_n_spilled_urls(spill_data, stat_data,
+                                                config['REPORT_SIZE'])
+        except SpillError:
+            logging.exception('Error merging aggregation data from disk!')
+            return False
+    else:
+        sum_data = summarize_data(report_data, stat_data)
+        top_n_urls = get_top_n_urls(sum_data, config['REPORT_SIZE'])
+    return generate_report(top_n_urls, log_date, config, suffix)
+
+
+def generate_report(data, log_date, config, suffix=''):
     """
-    Function generates report file in REPORT_DIR using TEMPLATE.
+    Function generates report file in REPORT_DIR using TEMPLATE and returns
+    True if report is written.
     """
     try:
         with open(config['TEMPLATE']) as html_template:
@@ -278,14 +931,16 @@ def generate_report(data, log_date, config):
             t = Template(html_template.read())
             report_html = t.safe_substitute(table_json=data)
             try:
-                report_name = 'report-' + log_date.strftime('%Y.%m.%d') + '.html'
+                report_name = 'report-' + log_date.strftime('%Y.%m.%d') + suffix + '.html'
                 with open(os.path.join(config['REPORT_DIR'], report_name), 'wt') as report:
                     logging.info('Generating report ' + report_name)
                     report.write(report_html)
+                return True
             except OSError:
                 logging.exception('Error writing file ' + report_name + '!')
     except OSError:
         logging.exception('Error reading file ' + config['TEMPLATE'] + '!')
+    return False
 
 
 def put_timestamp(timestamp_dir):
@@ -309,20 +964,146 @@ def check_if_report_exists(report_dir, log_date):
     return os.path.exists(report_name)
 
 
+def remove_report(report_dir, log_date, suffix):
+    """
+    Function removes report file with report name suffix from report_dir if
+    it exists.
+    """
+    report_name = os.path.join(report_dir, 'report-' + log_date.strftime('%Y.%m.%d') + suffix + '.html')
+    try:
+        if os.path.exists(report_name):
+            logging.info('Removing report ' + report_name)
+            os.remove(report_name)
+    except OSError:
+        logging.exception('Error removing file ' + report_name + '!')
+
+
 def calc_errors_perc(num_errors, total_requests):
     """
     Function calculates parsing errors percent of total_requests.
     """
+    if not total_requests:
+        return 0.0
     return round(num_errors / total_requests * 100, 2)
 
 
-def parse_args(args):
+def errors_exceeded(stat_data, config):
     """
-    Function parses command-line arguments
+    Function checks if parsing errors percent exceeds ERRORS_THRESHOLD.
+    """
+    errors_perc = calc_errors_perc(stat_data['parsing_errors'],
+                                   stat_data['total_requests'])
+    if errors_perc > float(config['ERRORS_THRESHOLD']):
+        logging.error('Too many parsing errors: ' + str(errors_perc) + ' > ' +
+                      str(config['ERRORS_THRESHOLD']))
+        return True
+    return False
+
+
+def parse_date(value):
+    """
+    Function converts command-line date value in YYYYMMDD format to datetime.
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date ' + value +
+                                         ', expected YYYYMMDD')
+
+
+def parse_fraction(value):
+    """
+    Function converts command-line sample fraction value to float in (0, 1].
+    """
+    try:
+        fraction = float(value)
+    except ValueError:
+        fraction = 0.0
+    if not 0.0 < fraction <= 1.0:
+        raise argparse.ArgumentTypeError('invalid fraction ' + value +
+                                         ', expected number in (0, 1]')
+    return fraction
+
+
+def get_args(args):
+    """
+    Function parses command-line arguments and returns them as namespace.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", help="Configuration file name")
-    return parser.parse_args(args).config if parser.parse_args(args).config is not None else CONFIG_NAME
+    parser.add_argument("input", nargs='?', choices=['-'],
+                        help="'-' reads log from standard input")
+    parser.add_argument("--stdin", action='store_true',
+                        help="Read log from standard input")
+    parser.add_argument("--date", type=parse_date,
+                        help="Log date in YYYYMMDD format for report naming")
+    parser.add_argument("--sample", type=parse_fraction, metavar="FRACTION",
+                        help="Build approximate report from random fraction "
+                             "of log lines")
+    return parser.parse_args(args)
+
+
+def parse_args(args):
+    """
+    Function parses command-line arguments
+    """
+    config_name = get_args(args).config
+    return config_name if config_name is not None else CONFIG_NAME
+
+
+def is_stream_input(args):
+    """
+    Function checks if log should be read from standard input.
+    """
+    return args.stdin or args.input == '-'
+
+
+def process_stdin(log_date, config, parse_line, spill_data=None):
+    """
+    Function processes log from standard input with parse_line and generates
+    report for log_date.
+    """
+    log_data, stat_data = process_log_stream(sys.stdin.buffer, log_date,
+                                             config, parse_line, spill_data)
+
+    if log_data is None:
+        logging.error('Error processing log stream. Exiting.')
+        logging.error('Finished processing...')
+        sys.exit(1)
+    elif errors_exceeded(stat_data, config):
+        logging.error('Finished processing...')
+        sys.exit(1)
+
+    if make_report(log_data, stat_data, log_date, config, spill_data):
+        remove_report(config['REPORT_DIR'], log_date, INTERIM_SUFFIX)
+    if spill_data is not None:
+        close_spill_data(spill_data)
+    put_timestamp(config['TIMESTAMP_DIR'])
+
+
+def process_sample(log_name, log_date, fraction, config, parse_line):
+    """
+    Function processes random fraction of lines of log file log_name with
+    parse_line and generates approximate report for log_date.
+    """
+    log_data, stat_data = process_log_sample(log_name, fraction,
+                                             config['SAMPLE_MAX_LINES'],
+                                             parse_line)
+
+    if log_data is None:
+        logging.error('Error sampling log file. Exiting.')
+        logging.error('Finished processing...')
+        sys.exit(1)
+    if 'total_requests_ci' in stat_data:
+        logging.info('Estimated lines: ' + str(stat_data['total_requests']) +
+                     ' ' + str(stat_data['total_requests_ci']) +
+                     ', parsing errors: ' + str(stat_data['parsing_errors']) +
+                     ' ' + str(stat_data['parsing_errors_ci']))
+    if errors_exceeded(stat_data, config):
+        logging.error('Finished processing...')
+        sys.exit(1)
+
+    make_report(log_data, stat_data, log_date, config, suffix='-sample')
 
 
 def main():
@@ -330,6 +1111,7 @@ def main():
     sys.excepthook = exception_handler
     working_config = config.copy()
 
+    args = get_args(sys.argv[1:])
     working_config = read_config_file(parse_args(sys.argv[1:]), working_config)
     if working_config is None:
         sys.exit(1)
@@ -338,29 +1120,63 @@ def main():
 
     logging.info('Started processing...')
 
+    parse_line = get_log_parser(working_config)
+    if parse_line is None:
+        logging.error('Wrong log format. Exiting.')
+        logging.error('Finished processing...')
+        sys.exit(1)
+
+    memory_limit = parse_size(working_config['MEMORY_LIMIT'])
+    if memory_limit is None:
+        logging.error('Wrong memory limit. Exiting.')
+        logging.error('Finished processing...')
+        sys.exit(1)
+    spill_data = new_spill_data(memory_limit) if memory_limit else None
+
+    if is_stream_input(args):
+        if args.sample is not None:
+            logging.error('Sampling of standard input is not supported. Exiting.')
+            logging.error('Finished processing...')
+            sys.exit(1)
+        if args.date is None:
+            logging.error('Log date is required for standard input. Exiting.')
+            logging.error('Finished processing...')
+            sys.exit(1)
+        if check_if_report_exists(working_config['REPORT_DIR'], args.date):
+            logging.info('Report file exists. Nothing to process.')
+            logging.info('Finished processing...')
+            return
+        process_stdin(args.date, working_config, parse_line, spill_data)
+        logging.info('Finished processing...')
+        return
+
     log_name, log_date = find_last_log(working_config)
     if log_name is None:
         logging.info('No log file to process. Exiting.')
         logging.info('Finished processing...')
         sys.exit(1)
 
+    if args.sample is not None:
+        process_sample(os.path.join(working_config['LOG_DIR'], log_name),
+                       log_date, args.sample, working_config, parse_line)
+        logging.info('Finished processing...')
+        return
+
     if not check_if_report_exists(working_config['REPORT_DIR'], log_date):
 
-        log_data, stat_data = process_log_file(os.path.join(working_config['LOG_DIR'], log_name))
+        log_data, stat_data = process_log_file(os.path.join(working_config['LOG_DIR'], log_name), parse_line, spill_data)
 
         if log_data is None:
             logging.error('Error processing log file. Exiting.')
             logging.error('Finished processing...')
             sys.exit(1)
-        elif calc_errors_perc(stat_data['parsing_errors'], stat_data['total_requests']) > float(working_config['ERRORS_THRESHOLD']):
-            print(calc_errors_perc(stat_data['parsing_errors'], stat_data['total_requests']))
-            logging.error('Too many parsing errors: ' + calc_errors_perc(stat_data['parsing_errors'], stat_data['total_requests']) + ' > ' + working_config['ERRORS_THRESHOLD'] + ' Exiting.')
+        elif errors_exceeded(stat_data, working_config):
             logging.error('Finished processing...')
             sys.exit(1)
 
-        sum_data = summarize_data(log_data, stat_data)
-        report_data = get_top_n_urls(sum_data, working_config['REPORT_SIZE'])
-        generate_report(report_data, log_date, working_config)
+        make_report(log_data, stat_data, log_date, working_config, spill_data)
+        if spill_data is not None:
+            close_spill_data(spill_data)
 
         put_timestamp(working_config['TIMESTAMP_DIR'])
     else:
@@ -1,9 +1,20 @@
 import unittest
 import log_analyzer
 import datetime
+import io
+import os
+import random
+import tempfile
 from decimal import Decimal
 
 
+UI_SHORT_FORMAT = """log_format ui_short '$remote_addr $remote_user $http_x_real_ip [$time_local]
+                     "$request" $status $body_bytes_sent "$http_referer"
+                     "$http_user_agent" "$http_x_forwarded_for"
+                     "$http_X_REQUEST_ID" "$http_X_RB_USER"
+                      $request_time';"""
+
+
 class Log_Analyzer_Test(unittest.TestCase):
     def setUp(self):
         self.config = {
@@ -356,3 +367,231 @@ class Log_Analyzer_Test(unittest.TestCase):
 
     def test_parse_args_if_config_is_not_empty(self):
         self.assertEqual("xxx", log_analyzer.parse_args(["--config", "xxx"]))
+
+    def test_get_args_stdin_dash(self):
+        args = log_analyzer.get_args(["-", "--date", "20170630"])
+        self.assertTrue(log_analyzer.is_stream_input(args))
+        self.assertEqual(args.date, datetime.datetime(2017, 6, 30, 0, 0))
+
+    def test_get_args_stdin_flag(self):
+        args = log_analyzer.get_args(["--stdin"])
+        self.assertTrue(log_analyzer.is_stream_input(args))
+        self.assertEqual(args.date, None)
+
+    def test_read_stream_chunks_splits_lines_across_chunks(self):
+        stream = io.BytesIO(b'first line\nsecond line\nthird')
+        lines = [line for chunk in log_analyzer.read_stream_chunks(stream, 4)
+                 for line in chunk]
+        self.assertEqual(lines, ['first line', 'second line', 'third'])
+
+    def test_process_log_stream_calculations(self):
+        line = b'1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n'
+        stream = io.BytesIO(line * 3 + b'broken line\n')
+        report_data, stat_data = log_analyzer.process_log_stream(
+            stream, datetime.datetime(2017, 6, 29), self.config)
+        url = '/api/v2/group/1769230/banners '
+        self.assertEqual(report_data[url]['count'], 3)
+        self.assertEqual(report_data[url]['time_sum'], Decimal('1.884'))
+        self.assertEqual(stat_data['total_requests'], 4)
+        self.assertEqual(stat_data['parsing_errors'], 1)
+
+    def test_process_log_stream_interim_report(self):
+        line = b'1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n'
+        with tempfile.TemporaryDirectory() as report_dir:
+            self.config['REPORT_DIR'] = report_dir
+            self.config['FLUSH_INTERVAL'] = 1e-9
+            log_analyzer.process_log_stream(
+                io.BytesIO(line * 3), datetime.datetime(2017, 6, 29),
+                self.config)
+            self.assertEqual(os.listdir(report_dir),
+                             ['report-2017.06.29-interim.html'])
+
+    def test_process_log_stream_interim_report_if_too_many_errors(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            self.config['REPORT_DIR'] = report_dir
+            self.config['FLUSH_INTERVAL'] = 1e-9
+            log_analyzer.process_log_stream(
+                io.BytesIO(b'broken line\n' * 3),
+                datetime.datetime(2017, 6, 29), self.config)
+            self.assertEqual(os.listdir(report_dir), [])
+
+    def test_remove_report(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_name = os.path.join(report_dir,
+                                       'report-2017.06.29-interim.html')
+            open(report_name, 'wt').close()
+            log_analyzer.remove_report(report_dir,
+                                       datetime.datetime(2017, 6, 29),
+                                       '-interim')
+            self.assertEqual(os.listdir(report_dir), [])
+
+    def test_calc_errors_perc_if_total_requests_is_zero(self):
+        self.assertEqual(log_analyzer.calc_errors_perc(0, 0), 0.0)
+
+    def test_normalize_log_format(self):
+        self.assertEqual(log_analyzer.normalize_log_format(
+                         "log_format short '$remote_addr [$time_local]\n"
+                         "                  \"$request\" $request_time';"),
+                         '$remote_addr [$time_local] "$request" $request_time')
+
+    def test_normalize_log_format_joins_strings_without_spaces(self):
+        log_format = "log_format m '$remote_addr [$time_local] \"$request\"' '$request_time';"
+        self.assertEqual(log_analyzer.normalize_log_format(log_format),
+                         '$remote_addr [$time_local] "$request"$request_time')
+        self.assertEqual(log_analyzer.compile_log_format(log_format)(
+                         '1.169.137.128 [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1"0.123'),
+                         ('/a ', '0.123'))
+
+    def test_normalize_log_format_skips_escape_parameter(self):
+        self.assertEqual(log_analyzer.normalize_log_format(
+                         "log_format m escape=json '$remote_addr \"$request\" $request_time';"),
+                         '$remote_addr "$request" $request_time')
+
+    def test_normalize_log_format_unescapes_quotes(self):
+        self.assertEqual(log_analyzer.normalize_log_format(
+                         'log_format m "$remote_addr \\"$request\\" $request_time";'),
+                         '$remote_addr "$request" $request_time')
+
+    def test_compile_log_format_fields_with_spaces(self):
+        parse_line = log_analyzer.compile_log_format(
+            '$remote_addr $time_local $http_user_agent "$request" $request_time')
+        line = '1.169.137.128 29/Jun/2017:03:50:22 +0300 Mozilla/5.0 (X11; Linux) "GET /a HTTP/1.1" 0.123'
+        self.assertEqual(parse_line(line), ('/a ', '0.123'))
+
+    def test_compile_log_format_if_request_time_is_missing(self):
+        self.assertEqual(log_analyzer.compile_log_format('$remote_addr "$request"'),
+                         None)
+
+    def test_compile_log_format_matches_process_log_line(self):
+        parse_line = log_analyzer.compile_log_format(UI_SHORT_FORMAT)
+        lines = [
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n',
+            '1.99.174.176 3b81f63526fa8  - [29/Jun/2017:03:50:22 +0300] "GET /api/1/photogenic_banners/list/?server_name=WIN7RB4 HTTP/1.1" 200 12 "-" "Python-urllib/2.7" "-" "1498697422-32900793-4708-9752770" "-" 0.133\n',
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "712e90144abee9" 0.628\n',
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "get /api/v2/group/1769230/banners http/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n',
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "DELETE /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n',
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/2.0" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n',
+            '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" -\n'
+        ]
+        for line in lines:
+            self.assertEqual(parse_line(line),
+                             log_analyzer.process_log_line(line))
+
+    def test_compile_log_format_request_time_in_the_middle(self):
+        parse_line = log_analyzer.compile_log_format(
+            '$remote_addr $request_time "$request" $status')
+        line = '1.169.137.128 0.628 "POST /api/v2/banner/25019354 HTTP/1.1" 200'
+        self.assertEqual(parse_line(line),
+                         ('/api/v2/banner/25019354 ', '0.628'))
+
+    def test_get_log_parser_if_log_format_is_empty(self):
+        self.assertEqual(log_analyzer.get_log_parser(self.config),
+                         log_analyzer.process_log_line)
+
+    def test_parse_size(self):
+        self.assertEqual(log_analyzer.parse_size('512M'), 512 * 1024 * 1024)
+        self.assertEqual(log_analyzer.parse_size(1000), 1000)
+        self.assertEqual(log_analyzer.parse_size('lots'), None)
+
+    def test_spilled_top_n_urls_equal_in_memory(self):
+        line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/{} HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" {}\n'
+        lines = [line.format(i * 7 % 13, '0.{}'.format(i * 37 % 1000))
+                 for i in range(300)]
+        lines += [line.format('tie' + str(i), '0.500') for i in range(5)]
+        report_data = {}
+        stat_data = log_analyzer.process_log_lines(
+            lines, report_data, log_analyzer.new_stat_data())
+        spill_data = log_analyzer.new_spill_data(4000, 3)
+        spill_stat_data = log_analyzer.process_log_lines(
+            lines, {}, log_analyzer.new_stat_data(),
+            spill_data=spill_data)
+        self.assertNotEqual(spill_data['prefix'], None)
+        self.assertTrue(len(spill_data['runs']) > 0)
+        self.assertEqual(spill_stat_data, stat_data)
+        self.assertEqual(
+            log_analyzer.get_top_n_spilled_urls(spill_data, stat_data, 15),
+            log_analyzer.get_top_n_urls(
+                log_analyzer.summarize_data(report_data, stat_data), 15))
+        log_analyzer.close_spill_data(spill_data)
+
+    def test_spill_data_if_few_urls(self):
+        line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/{} HTTP/1.1" 200 1020 "-" "Configovod" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" 0.628\n'
+        spill_data = log_analyzer.new_spill_data(64 * 1024)
+        log_analyzer.process_log_lines(
+            (line.format(i % 10) for i in range(20000)), {},
+            log_analyzer.new_stat_data(), spill_data=spill_data)
+        self.assertEqual(spill_data['prefix'], None)
+        self.assertEqual(len(spill_data['urls']), 10)
+
+    def test_read_sampled_line_resynchronizes_on_next_line(self):
+        log_file = io.BytesIO(b'first\nsecond line\nthird')
+        self.assertEqual(log_analyzer.read_sampled_line(log_file, 2, 23),
+                         (6, 'second line'))
+        self.assertEqual(log_analyzer.read_sampled_line(log_file, 5, 23),
+                         (6, 'second line'))
+        self.assertEqual(log_analyzer.read_sampled_line(log_file, 6, 23),
+                         (12, 'third'))
+        self.assertEqual(log_analyzer.read_sampled_line(log_file, 20, 23),
+                         (None, None))
+
+    def test_estimate_interval(self):
+        self.assertEqual(log_analyzer.estimate_interval(10.0, 100.0, 1),
+                         (10.0, 10.0, 10.0))
+        mean, low, high = log_analyzer.estimate_interval(20.0, 200.0, 4)
+        self.assertEqual(mean, 5.0)
+        self.assertTrue(low < mean < high)
+
+    def test_process_log_sample_if_log_file_is_compressed(self):
+        self.assertEqual(log_analyzer.process_log_sample("log.gz", 0.1, 100),
+                         (None, None))
+
+    def test_process_log_sample_estimates_within_confidence_intervals(self):
+        line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/{} HTTP/1.1" 200 1020 "-" "{}" "-" "1498697422-2118016444-4708-9752747" "712e90144abee9" {:.3f}\n'
+        broken_line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/{} HTTP/1.1" 200 1020 "-" "{}" "712e90144abee9" {:.3f}\n'
+        generator = random.Random(11)
+        lines = []
+        for _ in range(4000):
+            line_format = broken_line if generator.random() < 0.05 else line
+            lines.append(line_format.format(generator.randrange(5),
+                                            'x' * generator.randrange(100),
+                                            generator.random()))
+        # long last line makes draws land in it and find no next line
+        lines.append('broken line' + 'x' * 60000 + '\n')
+        report_data = {}
+        stat_data = log_analyzer.process_log_lines(
+            lines, report_data, log_analyzer.new_stat_data())
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_name = os.path.join(log_dir, 'nginx-access-ui.log-20170630')
+            with open(log_name, 'wt') as log_file:
+                log_file.writelines(lines)
+            sample_data, sample_stat_data = log_analyzer.process_log_sample(
+                log_name, 0.05, 100000, generator=random.Random(2))
+        self.assertEqual(set(sample_data), set(report_data))
+        for url, url_data in sample_data.items():
+            low, high = url_data['count_ci']
+            self.assertTrue(low <= report_data[url]['count'] <= high)
+            low, high = url_data['time_sum_ci']
+            self.assertTrue(low <= report_data[url]['time_sum'] <= high)
+        for key in ('total_requests', 'parsing_errors'):
+            low, high = sample_stat_data[key + '_ci']
+            self.assertTrue(low <= stat_data[key] <= high)
+
+    def test_construct_list_with_confidence_intervals(self):
+        data = {
+                'count': 10,
+                'time_sum': Decimal('10.4445454'),
+                'time_max': Decimal('1.58498'),
+                'count_perc': 7.343488,
+                'time_perc': Decimal('20.54575'),
+                'time_avg': Decimal(1.5454675),
+                'time_med': Decimal(45.45453467),
+                'count_ci': (8, 12),
+                'time_sum_ci': (Decimal('9.1234'), Decimal('11.9876'))
+        }
+        result = log_analyzer.construct_list('/api', data)
+        self.assertEqual(result['count_ci'], [8, 12])
+        self.assertEqual(result['time_sum_ci'], [9.123, 11.988])
+
+    def test_get_args_sample(self):
+        self.assertEqual(log_analyzer.get_args(["--sample", "0.01"]).sample,
+                         0.01)